@@ -1,27 +1,186 @@
 """
 Data ingestion module for fetching ISS and space data from NASA APIs
 """
-import requests
-import json
+import asyncio
+import httpx
+import orjson
+import random
+import threading
+import time
+import weakref
+from cachetools import TTLCache
 from datetime import datetime
 from typing import Dict, Any, Optional
 
+# Server errors are retried with exponential backoff (0.5s, 1s, 2s)
+RETRY_TOTAL = 3
+RETRY_BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = frozenset({500, 502, 503, 504})
+
+# After this many consecutive failed fetches of an endpoint, skip it for the cooldown period
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN_SECONDS = 60
+
+# Region bounding boxes as (name, lat_min, lat_max, lon_min, lon_max), exclusive.
+# The first matching box wins. Ordered by how often the ISS ground track (±51.6°
+# latitude) falls in each region, but overlapping boxes keep their original
+# precedence (Arctic before the northern continents, Europe before Africa
+# before Asia) so classification is unchanged.
+_REGIONS = (
+    ('Pacific Ocean', -60, 60, -180, -80),
+    ('Atlantic Ocean', -60, 60, -80, 20),
+    ('Indian Ocean', -60, 30, 20, 147),
+    ('Arctic Ocean', 66, float('inf'), float('-inf'), float('inf')),
+    ('Europe', 35, 72, -10, 40),
+    ('Africa', -35, 37, -18, 52),
+    ('Asia', -10, 82, 26, 180),
+    ('Australia', -44, -10, 113, 154),
+    ('North America', 15, 72, -168, -52),
+    ('South America', -56, 15, -82, -34),
+    ('Antarctic', float('-inf'), -60, float('-inf'), float('inf')),
+)
+
 class SpaceDataFetcher:
     def __init__(self):
         self.iss_api_url = "http://api.open-notify.org/iss-now.json"
         self.astronauts_api_url = "http://api.open-notify.org/astros.json"
         self.nasa_api_base = "https://api.nasa.gov"
+        # One HTTP client per event loop, since an AsyncClient's pool can't cross loops
+        self._clients = weakref.WeakKeyDictionary()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._loop_lock = threading.Lock()
         
-    def get_iss_location(self) -> Dict[str, Any]:
-        """Fetch current ISS location"""
+        # ISS position drifts every few seconds, the crew roster every few weeks
+        self._iss_cache = TTLCache(maxsize=1, ttl=5)
+        self._astro_cache = TTLCache(maxsize=1, ttl=3600)
+        self._cache_lock = threading.Lock()
+        
+        # Circuit breaker state per endpoint URL
+        self._breakers: Dict[str, Dict[str, float]] = {}
+        self._rng = random.Random()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    async def __aenter__(self):
+        # Keep a client for this loop until __aexit__, shared by every call in the block
+        self._get_client()
+        return self
+    
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+    
+    def cache_clear(self):
+        """Drop cached API responses"""
+        with self._cache_lock:
+            self._iss_cache.clear()
+            self._astro_cache.clear()
+    
+    def _cache_get(self, cache: TTLCache) -> Optional[Dict[str, Any]]:
+        with self._cache_lock:
+            return cache.get('v')
+    
+    def _cache_set(self, cache: TTLCache, value: Dict[str, Any]):
+        with self._cache_lock:
+            cache['v'] = value
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """Lazily create the running loop's HTTP client (keep-alive + connection pooling)"""
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = httpx.AsyncClient(
+                timeout=10,
+                transport=httpx.AsyncHTTPTransport(
+                    retries=3,
+                    limits=httpx.Limits(max_connections=10, max_keepalive_connections=10)
+                )
+            )
+        return client
+    
+    def _run(self, coro):
+        """Run a coroutine on the fetcher's background event loop and wait for the result
+        
+        The loop lives in its own thread so pooled connections survive between calls,
+        and the sync API stays usable from several threads or from inside another loop.
+        """
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(
+                    target=self._loop.run_forever, name='SpaceDataFetcher-loop', daemon=True
+                )
+                self._loop_thread.start()
+            loop = self._loop
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+    
+    async def aclose(self):
+        """Close the running loop's HTTP client"""
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+    
+    def close(self):
+        """Close the HTTP client and stop the event loop used by the sync API"""
+        with self._loop_lock:
+            loop, thread = self._loop, self._loop_thread
+            self._loop = self._loop_thread = None
+        if loop is None:
+            return
+        
+        asyncio.run_coroutine_threadsafe(self.aclose(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+    
+    def _breaker(self, url: str) -> Dict[str, float]:
+        return self._breakers.setdefault(url, {'fail_count': 0, 'opened_at': 0.0})
+    
+    def _breaker_open(self, url: str) -> bool:
+        """True while the endpoint is considered down and calls should go straight to mock data"""
+        breaker = self._breaker(url)
+        return (breaker['fail_count'] >= BREAKER_THRESHOLD and
+                time.time() - breaker['opened_at'] < BREAKER_COOLDOWN_SECONDS)
+    
+    async def _get_json(self, url: str) -> Dict[str, Any]:
+        """GET a JSON endpoint, retrying server errors and tracking failures for its breaker"""
+        breaker = self._breaker(url)
         try:
-            response = requests.get(self.iss_api_url, timeout=10)
+            for attempt in range(RETRY_TOTAL + 1):
+                response = await self._get_client().get(url)
+                if response.status_code not in RETRY_STATUSES or attempt == RETRY_TOTAL:
+                    break
+                await asyncio.sleep(RETRY_BACKOFF_FACTOR * 2 ** attempt)
+            
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
+        except Exception:
+            breaker['fail_count'] += 1
+            if breaker['fail_count'] >= BREAKER_THRESHOLD:
+                breaker['opened_at'] = time.time()
+            raise
+        
+        breaker['fail_count'] = 0
+        return data
+        
+    async def get_iss_location(self) -> Dict[str, Any]:
+        """Fetch current ISS location"""
+        cached = self._cache_get(self._iss_cache)
+        if cached is not None:
+            return cached
+        if self._breaker_open(self.iss_api_url):
+            return self._get_mock_iss_data()
+        
+        try:
+            data = await self._get_json(self.iss_api_url)
             
             if data.get('message') == 'success':
                 position = data['iss_position']
-                return {
+                location = {
                     'latitude': float(position['latitude']),
                     'longitude': float(position['longitude']),
                     'timestamp': data['timestamp'],
@@ -30,68 +189,59 @@ class SpaceDataFetcher:
                         float(position['longitude'])
                     )
                 }
+                self._cache_set(self._iss_cache, location)
+                return location
         except Exception as e:
             print(f"Error fetching ISS location: {e}")
             return self._get_mock_iss_data()
     
-    def get_astronauts_info(self) -> Dict[str, Any]:
+    async def get_astronauts_info(self) -> Dict[str, Any]:
         """Fetch current astronauts in space"""
+        cached = self._cache_get(self._astro_cache)
+        if cached is not None:
+            return cached
+        if self._breaker_open(self.astronauts_api_url):
+            return self._get_mock_astronauts_data()
+        
         try:
-            response = requests.get(self.astronauts_api_url, timeout=10)
-            response.raise_for_status()
-            data = response.json()
+            data = await self._get_json(self.astronauts_api_url)
             
             if data.get('message') == 'success':
-                return {
+                astronauts = {
                     'count': data['number'],
                     'astronauts': data['people'],
                     'timestamp': datetime.now().timestamp()
                 }
+                self._cache_set(self._astro_cache, astronauts)
+                return astronauts
         except Exception as e:
             print(f"Error fetching astronauts info: {e}")
             return self._get_mock_astronauts_data()
     
     def get_space_telemetry(self) -> Dict[str, Any]:
         """Generate mock telemetry data for MVP"""
-        import random
-        
         return {
-            'altitude_km': round(random.uniform(408, 420), 2),
-            'velocity_kmh': round(random.uniform(27500, 27700), 2),
-            'solar_panel_efficiency': round(random.uniform(85, 95), 1),
-            'cosmic_ray_intensity': round(random.uniform(0.1, 2.5), 2),
-            'temperature_celsius': round(random.uniform(-157, 121), 1),
+            'altitude_km': round(self._rng.uniform(408, 420), 2),
+            'velocity_kmh': round(self._rng.uniform(27500, 27700), 2),
+            'solar_panel_efficiency': round(self._rng.uniform(85, 95), 1),
+            'cosmic_ray_intensity': round(self._rng.uniform(0.1, 2.5), 2),
+            'temperature_celsius': round(self._rng.uniform(-157, 121), 1),
             'timestamp': datetime.now().timestamp()
         }
     
     def _get_region_from_coordinates(self, lat: float, lon: float) -> str:
         """Map coordinates to Earth regions"""
-        regions = {
-            'Pacific Ocean': (lat > -60 and lat < 60 and lon > -180 and lon < -80),
-            'Atlantic Ocean': (lat > -60 and lat < 60 and lon > -80 and lon < 20),
-            'Indian Ocean': (lat > -60 and lat < 30 and lon > 20 and lon < 147),
-            'Arctic Ocean': (lat > 66),
-            'Antarctic': (lat < -60),
-            'North America': (lat > 15 and lat < 72 and lon > -168 and lon < -52),
-            'South America': (lat > -56 and lat < 15 and lon > -82 and lon < -34),
-            'Europe': (lat > 35 and lat < 72 and lon > -10 and lon < 40),
-            'Africa': (lat > -35 and lat < 37 and lon > -18 and lon < 52),
-            'Asia': (lat > -10 and lat < 82 and lon > 26 and lon < 180),
-            'Australia': (lat > -44 and lat < -10 and lon > 113 and lon < 154),
-        }
-        
-        for region, condition in regions.items():
-            if condition:
-                return region
+        for name, lat_min, lat_max, lon_min, lon_max in _REGIONS:
+            if lat_min < lat < lat_max and lon_min < lon < lon_max:
+                return name
         
         return 'Open Ocean'
     
     def _get_mock_iss_data(self) -> Dict[str, Any]:
         """Fallback mock data if API fails"""
-        import random
         return {
-            'latitude': round(random.uniform(-51.6, 51.6), 4),
-            'longitude': round(random.uniform(-180, 180), 4),
+            'latitude': round(self._rng.uniform(-51.6, 51.6), 4),
+            'longitude': round(self._rng.uniform(-180, 180), 4),
             'timestamp': datetime.now().timestamp(),
             'region': 'Pacific Ocean'
         }
@@ -106,16 +256,34 @@ class SpaceDataFetcher:
             'timestamp': datetime.now().timestamp()
         }
     
-    def get_complete_space_data(self) -> Dict[str, Any]:
-        """Fetch all space data for journal entry generation"""
+    async def get_complete_space_data_async(self) -> Dict[str, Any]:
+        """Fetch all space data, running the independent HTTP calls concurrently
+        
+        Outside the fetcher's own loop (and outside ``async with fetcher``) the HTTP
+        client only lives for this call.
+        """
+        loop = asyncio.get_running_loop()
+        owns_client = loop is not self._loop and loop not in self._clients
+        try:
+            iss_location, astronauts = await asyncio.gather(
+                self.get_iss_location(),
+                self.get_astronauts_info()
+            )
+        finally:
+            if owns_client:
+                await self.aclose()
         return {
-            'iss_location': self.get_iss_location(),
-            'astronauts': self.get_astronauts_info(),
+            'iss_location': iss_location,
+            'astronauts': astronauts,
             'telemetry': self.get_space_telemetry(),
             'generated_at': datetime.now().isoformat()
         }
+    
+    def get_complete_space_data(self) -> Dict[str, Any]:
+        """Fetch all space data for journal entry generation"""
+        return self._run(self.get_complete_space_data_async())
 
 if __name__ == "__main__":
-    fetcher = SpaceDataFetcher()
-    data = fetcher.get_complete_space_data()
-    print(json.dumps(data, indent=2))
+    with SpaceDataFetcher() as fetcher:
+        data = fetcher.get_complete_space_data()
+    print(orjson.dumps(data, option=orjson.OPT_INDENT_2).decode())
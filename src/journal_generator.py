@@ -2,16 +2,278 @@
 Journal generator module for creating astronaut diary entries using LLM
 """
 import os
-from typing import Dict, Any
+import asyncio
+import functools
+import json
+import orjson
+import hashlib
+import re
+import threading
+import time
+import uuid
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
+import diskcache
+import httpx
+import numpy as np
 import openai
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Only near-deterministic completions are cached; higher temperatures are meant to vary
+CACHE_MAX_TEMPERATURE = 0.2
+CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# Near-duplicate contexts reuse a previous journal entry. Entries quote the
+# telemetry, so every rounded value shown in the prompt except the coordinates
+# must match exactly; only the situation lines (not the fixed instructions) are
+# embedded, so the similarity threshold effectively compares nearby positions.
+# Note this deliberately reuses temperature-0.8 output, which the exact-match
+# cache above refuses to do: variation between near-identical moments is traded
+# for fewer calls.
+EMBEDDING_MODEL = "text-embedding-3-small"
+SEMANTIC_CACHE_PREFIX = 'semantic_journal_entry_v2'
+SEMANTIC_CACHE_EXACT_FIELDS = (
+    'region', 'time_of_day', 'altitude', 'velocity', 'temperature', 'cosmic_rays', 'crew_count'
+)
+SEMANTIC_CACHE_THRESHOLD = 0.95
+SEMANTIC_CACHE_MAX_ENTRIES = 100  # per set of exact fields
+
+# A 200-word entry plus its JSON wrapping is roughly 300 tokens; a completion cut
+# off at max_tokens is retried once with the larger budget
+JOURNAL_MAX_TOKENS = 600
+JOURNAL_RETRY_MAX_TOKENS = 1200
+
+# In-memory semantic indexes, one per cache directory, loaded on first use and
+# shared by every generator using that directory
+_semantic_indexes: Dict[str, Dict[Tuple[str, ...], Dict[str, Any]]] = {}
+_semantic_indexes_lock = threading.Lock()
+
+JOURNAL_SYSTEM_PROMPT = """You are an astronaut aboard the International Space Station writing in your personal diary. 
+Write in first person, be poetic and contemplative, focusing on the wonder of space, Earth's beauty, 
+and the human experience in microgravity. 
+Be specific about locations and technical details but make them feel personal and emotional.
+Respond with a strict JSON object with keys "title" (3-8 words, no quotes) and "entry" (100-200 words).
+The title should be poetic and evocative and capture the essence of the experience. 
+Examples: "Whispers Over the Pacific", "Dancing with Aurora", "Silence Above the Sahara"."""
+
+# Time-of-day context for each hour 0-23
+_NIGHT = "Night shift - Darkness revealing Earth's glow"
+_HOUR_CONTEXT = (
+    (_NIGHT,) * 5 +
+    ("Morning watch - Earth awakening below",) * 7 +
+    ("Afternoon orbit - Sun illuminating continents",) * 5 +
+    ("Evening pass - City lights beginning to twinkle",) * 4 +
+    (_NIGHT,) * 3
+)
+
+@functools.lru_cache(maxsize=1)
+def _get_openai_client() -> openai.OpenAI:
+    """Process-wide OpenAI client so generators share one connection pool"""
+    return openai.OpenAI(
+        api_key=os.getenv('OPENAI_API_KEY'),
+        http_client=httpx.Client(limits=httpx.Limits(max_keepalive_connections=20))
+    )
+
+def _new_async_openai_client() -> openai.AsyncOpenAI:
+    """AsyncOpenAI client for one batch; async pools are tied to their event loop, so
+    callers own the client and close it when done rather than sharing it process-wide"""
+    return openai.AsyncOpenAI(
+        api_key=os.getenv('OPENAI_API_KEY'),
+        http_client=httpx.AsyncClient(limits=httpx.Limits(max_keepalive_connections=20))
+    )
+
 class AstronautJournalGenerator:
     def __init__(self):
-        self.client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        self.client = _get_openai_client()
+        self.cache = diskcache.Cache(os.path.expanduser('~/.cache/voc_journal'))
+    
+    def _chat_cache_key(self, messages: List[Dict[str, str]], model: str,
+                        temperature: float, max_tokens: int,
+                        response_format: Optional[Dict[str, str]]) -> Optional[str]:
+        """Cache key for a chat request, or None if the request shouldn't be cached"""
+        if temperature > CACHE_MAX_TEMPERATURE:
+            return None
+        return hashlib.sha256(
+            json.dumps([model, messages, temperature, max_tokens, response_format], sort_keys=True).encode()
+        ).hexdigest()
+    
+    def _cached_chat(self, messages: List[Dict[str, str]], model: str,
+                     temperature: float, max_tokens: int,
+                     response_format: Optional[Dict[str, str]] = None) -> Tuple[str, str]:
+        """Run a chat completion, reusing the on-disk result for identical low-temperature requests
+        
+        Returns (content, finish_reason); truncated completions are never cached.
+        """
+        key = self._chat_cache_key(messages, model, temperature, max_tokens, response_format)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached, 'stop'
+        
+        extra = {'response_format': response_format} if response_format else {}
+        response = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            **extra
+        )
+        choice = response.choices[0]
+        
+        if key is not None and choice.finish_reason != 'length':
+            self.cache.set(key, choice.message.content, expire=CACHE_TTL_SECONDS)
+        return choice.message.content, choice.finish_reason
+    
+    async def _acached_chat(self, aclient: openai.AsyncOpenAI,
+                            messages: List[Dict[str, str]], model: str,
+                            temperature: float, max_tokens: int,
+                            response_format: Optional[Dict[str, str]] = None) -> Tuple[str, str]:
+        """Async counterpart of _cached_chat"""
+        key = self._chat_cache_key(messages, model, temperature, max_tokens, response_format)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached, 'stop'
+        
+        extra = {'response_format': response_format} if response_format else {}
+        response = await aclient.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            **extra
+        )
+        choice = response.choices[0]
+        
+        if key is not None and choice.finish_reason != 'length':
+            self.cache.set(key, choice.message.content, expire=CACHE_TTL_SECONDS)
+        return choice.message.content, choice.finish_reason
+    
+    def _embed(self, text: str) -> Optional[np.ndarray]:
+        """Embed text as a unit vector, or None if the embedding call fails"""
+        try:
+            response = self.client.embeddings.create(model=EMBEDDING_MODEL, input=text)
+        except Exception as e:
+            print(f"Error embedding journal context: {e}")
+            return None
+        
+        return self._normalize_embedding(response.data[0].embedding)
+    
+    async def _aembed(self, aclient: openai.AsyncOpenAI, text: str) -> Optional[np.ndarray]:
+        """Async counterpart of _embed"""
+        try:
+            response = await aclient.embeddings.create(model=EMBEDDING_MODEL, input=text)
+        except Exception as e:
+            print(f"Error embedding journal context: {e}")
+            return None
+        
+        return self._normalize_embedding(response.data[0].embedding)
+    
+    @staticmethod
+    def _normalize_embedding(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+    
+    def _semantic_index(self) -> Dict[Tuple[str, ...], Dict[str, Any]]:
+        """The semantic index for this cache directory, loading it on first use
+        
+        Maps exact fields -> {'keys': disk keys, 'entries': (journal text, title) pairs,
+        'created': creation times, 'matrix': unit embeddings}, one row per entry, oldest first.
+        """
+        with _semantic_indexes_lock:
+            index = _semantic_indexes.get(self.cache.directory)
+            if index is None:
+                index = _semantic_indexes[self.cache.directory] = self._load_semantic_entries()
+            return index
+    
+    def _load_semantic_entries(self) -> Dict[Tuple[str, ...], Dict[str, Any]]:
+        """Build the in-memory semantic index from the per-entry disk keys"""
+        stored: Dict[Tuple[str, ...], List] = {}
+        expired_before = time.time() - CACHE_TTL_SECONDS
+        for key in self.cache.iterkeys():
+            if isinstance(key, tuple) and key[0] == SEMANTIC_CACHE_PREFIX:
+                value = self.cache.get(key)
+                if value is not None and value[0] >= expired_before:
+                    stored.setdefault(key[1:-1], []).append((key, value))
+        
+        index = {}
+        for partition, items in stored.items():
+            # Oldest first, so eviction order survives a restart
+            items.sort(key=lambda item: item[1][0])
+            for key, _ in items[:-SEMANTIC_CACHE_MAX_ENTRIES]:
+                self.cache.delete(key)
+            items = items[-SEMANTIC_CACHE_MAX_ENTRIES:]
+            index[partition] = {
+                'keys': [key for key, _ in items],
+                'entries': [(journal_text, title) for _, (_, _, journal_text, title) in items],
+                'created': np.array([created for _, (created, _, _, _) in items]),
+                'matrix': np.stack([vector for _, (_, vector, _, _) in items])
+            }
+        return index
+    
+    def _semantic_drop(self, bucket: Dict[str, Any], count: int):
+        """Drop the oldest entries of a partition from the index and the disk cache"""
+        for key in bucket['keys'][:count]:
+            self.cache.delete(key)
+        del bucket['keys'][:count]
+        del bucket['entries'][:count]
+        bucket['created'] = bucket['created'][count:]
+        bucket['matrix'] = bucket['matrix'][count:]
+    
+    @staticmethod
+    def _semantic_partition(fields: Dict[str, str]) -> Tuple[str, ...]:
+        """Context fields that must match exactly for an entry to be reused"""
+        return tuple(fields[name] for name in SEMANTIC_CACHE_EXACT_FIELDS)
+    
+    def _semantic_lookup(self, partition: Tuple[str, ...], vector: np.ndarray) -> Optional[Tuple[str, str]]:
+        """Return (journal_text, title) of the most similar cached context with the same
+        exact fields, if it is above the threshold and hasn't expired"""
+        index = self._semantic_index()
+        with _semantic_indexes_lock:
+            bucket = index.get(partition)
+            if bucket is None:
+                return None
+            
+            expired = int(np.searchsorted(bucket['created'], time.time() - CACHE_TTL_SECONDS))
+            if expired:
+                self._semantic_drop(bucket, expired)
+            if not bucket['keys']:
+                del index[partition]
+                return None
+            
+            similarities = bucket['matrix'] @ vector
+            best = int(similarities.argmax())
+            if similarities[best] < SEMANTIC_CACHE_THRESHOLD:
+                return None
+            
+            return bucket['entries'][best]
+    
+    def _semantic_store(self, partition: Tuple[str, ...], vector: np.ndarray, journal_text: str, title: str):
+        """Remember a generated entry under its context embedding, one disk key per entry"""
+        index = self._semantic_index()
+        created = time.time()
+        key = (SEMANTIC_CACHE_PREFIX, *partition, uuid.uuid4().hex)
+        self.cache.set(key, (created, vector, journal_text, title), expire=CACHE_TTL_SECONDS)
+        
+        with _semantic_indexes_lock:
+            bucket = index.get(partition)
+            if bucket is None:
+                index[partition] = {
+                    'keys': [key],
+                    'entries': [(journal_text, title)],
+                    'created': np.array([created]),
+                    'matrix': vector[np.newaxis, :]
+                }
+                return
+            
+            bucket['keys'].append(key)
+            bucket['entries'].append((journal_text, title))
+            bucket['created'] = np.append(bucket['created'], created)
+            bucket['matrix'] = np.vstack((bucket['matrix'], vector))
+            if len(bucket['keys']) > SEMANTIC_CACHE_MAX_ENTRIES:
+                self._semantic_drop(bucket, len(bucket['keys']) - SEMANTIC_CACHE_MAX_ENTRIES)
         
     def generate_journal_entry(self, space_data: Dict[str, Any]) -> Dict[str, str]:
         """Generate a poetic astronaut journal entry from space data"""
@@ -22,84 +284,192 @@ class AstronautJournalGenerator:
         astronauts = space_data.get('astronauts', {})
         
         # Create context for the LLM
-        context = self._build_context_prompt(iss_location, telemetry, astronauts)
+        fields = self._context_fields(iss_location, telemetry, astronauts)
+        context = self._format_context_prompt(fields)
+        partition = self._semantic_partition(fields)
+        
+        # Reuse the entry of a near-identical earlier context if we have one
+        context_vector = self._embed(self._format_situation(fields))
+        if context_vector is not None:
+            cached = self._semantic_lookup(partition, context_vector)
+            if cached is not None:
+                return self._journal_result(*cached)
         
         try:
-            # Generate journal entry
-            journal_response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": """You are an astronaut aboard the International Space Station writing in your personal diary. 
-                        Write in first person, be poetic and contemplative, focusing on the wonder of space, Earth's beauty, 
-                        and the human experience in microgravity. Keep entries between 100-200 words. 
-                        Be specific about locations and technical details but make them feel personal and emotional."""
-                    },
-                    {
-                        "role": "user",
-                        "content": context
-                    }
-                ],
-                max_tokens=300,
-                temperature=0.8
-            )
+            # Generate title and entry in a single JSON-mode completion
+            content, finish_reason = self._cached_chat(**self._journal_request(context))
+            if finish_reason == 'length':
+                content, finish_reason = self._cached_chat(
+                    **self._journal_request(context, JOURNAL_RETRY_MAX_TOKENS)
+                )
+            journal_text, title, complete = self._journal_from_completion(content, finish_reason, iss_location)
+            
+            if complete and context_vector is not None:
+                self._semantic_store(partition, context_vector, journal_text, title)
             
-            journal_text = journal_response.choices[0].message.content.strip()
+            return self._journal_result(journal_text, title)
             
-            # Generate title
-            title_response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": """Create a poetic, evocative title for an astronaut's journal entry. 
-                        The title should be 3-8 words and capture the essence of the experience. 
-                        Examples: "Whispers Over the Pacific", "Dancing with Aurora", "Silence Above the Sahara"."""
-                    },
-                    {
-                        "role": "user",
-                        "content": f"Create a title for this journal entry: {journal_text[:200]}..."
-                    }
-                ],
-                max_tokens=50,
-                temperature=0.9
-            )
+        except Exception as e:
+            print(f"Error generating journal entry: {e}")
+            return self._get_fallback_journal_entry(iss_location, telemetry)
+    
+    async def generate_journal_entry_async(self, space_data: Dict[str, Any]) -> Dict[str, str]:
+        """Async counterpart of generate_journal_entry"""
+        aclient = _new_async_openai_client()
+        try:
+            return await self._generate_journal_entry_async(aclient, space_data)
+        finally:
+            await aclient.close()
+    
+    async def _generate_journal_entry_async(self, aclient: openai.AsyncOpenAI,
+                                            space_data: Dict[str, Any]) -> Dict[str, str]:
+        iss_location = space_data.get('iss_location', {})
+        telemetry = space_data.get('telemetry', {})
+        astronauts = space_data.get('astronauts', {})
+        
+        fields = self._context_fields(iss_location, telemetry, astronauts)
+        context = self._format_context_prompt(fields)
+        partition = self._semantic_partition(fields)
+        
+        context_vector = await self._aembed(aclient, self._format_situation(fields))
+        if context_vector is not None:
+            cached = self._semantic_lookup(partition, context_vector)
+            if cached is not None:
+                return self._journal_result(*cached)
+        
+        try:
+            content, finish_reason = await self._acached_chat(aclient, **self._journal_request(context))
+            if finish_reason == 'length':
+                content, finish_reason = await self._acached_chat(
+                    aclient, **self._journal_request(context, JOURNAL_RETRY_MAX_TOKENS)
+                )
+            journal_text, title, complete = self._journal_from_completion(content, finish_reason, iss_location)
             
-            title = title_response.choices[0].message.content.strip().replace('"', '')
+            if complete and context_vector is not None:
+                self._semantic_store(partition, context_vector, journal_text, title)
             
-            return {
-                'title': title,
-                'journal_entry': journal_text,
-                'generated_at': datetime.now().isoformat()
-            }
+            return self._journal_result(journal_text, title)
             
         except Exception as e:
             print(f"Error generating journal entry: {e}")
             return self._get_fallback_journal_entry(iss_location, telemetry)
     
-    def _build_context_prompt(self, iss_location: Dict, telemetry: Dict, astronauts: Dict) -> str:
+    async def generate_journal_entries_async(self, snapshots: List[Dict[str, Any]],
+                                             concurrency: int = 8) -> List[Dict[str, str]]:
+        """Generate journal entries for many space data snapshots concurrently"""
+        semaphore = asyncio.Semaphore(concurrency)
+        aclient = _new_async_openai_client()
+        
+        async def _one(space_data: Dict[str, Any]) -> Dict[str, str]:
+            async with semaphore:
+                return await self._generate_journal_entry_async(aclient, space_data)
+        
+        try:
+            return await asyncio.gather(*[_one(snapshot) for snapshot in snapshots])
+        finally:
+            await aclient.close()
+    
+    def _journal_request(self, context: str, max_tokens: int = JOURNAL_MAX_TOKENS) -> Dict[str, Any]:
+        """Chat request asking for the title and entry as one JSON object"""
+        return {
+            'model': "gpt-3.5-turbo",
+            'messages': [
+                {
+                    "role": "system",
+                    "content": JOURNAL_SYSTEM_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": context
+                }
+            ],
+            'max_tokens': max_tokens,
+            'temperature': 0.8,
+            'response_format': {"type": "json_object"}
+        }
+    
+    def _parse_journal(self, content: str) -> Tuple[str, str]:
+        """Extract (journal_text, title) from a JSON-mode completion"""
+        journal = orjson.loads(content)
+        return journal['entry'].strip(), journal['title'].strip().replace('"', '')
+    
+    def _journal_from_completion(self, content: str, finish_reason: str,
+                                 iss_location: Dict) -> Tuple[str, str, bool]:
+        """Return (journal_text, title, complete) for a journal completion
+        
+        A completion cut off at max_tokens is invalid JSON, so the entry is recovered
+        from the partial object instead; complete is False in that case.
+        """
+        if finish_reason != 'length':
+            return (*self._parse_journal(content), True)
+        
+        print("Journal entry truncated at max_tokens, keeping the partial entry")
+        journal_text = self._salvage_json_string(content, 'entry')
+        if not journal_text:
+            raise ValueError("Truncated journal completion has no entry text")
+        title = (self._salvage_json_string(content, 'title') or
+                 self._get_fallback_journal_entry(iss_location, {})['title'])
+        return journal_text, title.replace('"', ''), False
+    
+    @staticmethod
+    def _salvage_json_string(content: str, field: str) -> Optional[str]:
+        """Value of a string field in a possibly truncated JSON object, if present"""
+        match = re.search(r'"%s"\s*:\s*"((?:[^"\\]|\\.)*)' % field, content)
+        if match is None:
+            return None
+        raw = match.group(1)
+        # Drop an escape sequence cut off by the truncation before decoding
+        escape = re.search(r'(\\+)(u[0-9a-fA-F]{0,3})?$', raw)
+        if escape is not None and len(escape.group(1)) % 2:
+            raw = raw[:escape.end(1) - 1]
+        return json.loads(f'"{raw}"').strip()
+    
+    def _journal_result(self, journal_text: str, title: str) -> Dict[str, str]:
+        return {
+            'title': title,
+            'journal_entry': journal_text,
+            'generated_at': datetime.now().isoformat()
+        }
+    
+    def _build_context_prompt(self, iss_location: Dict, telemetry: Dict, astronauts: Dict,
+                              time_of_day: Optional[str] = None) -> str:
         """Build context prompt for LLM"""
-        region = iss_location.get('region', 'Unknown region')
+        fields = self._context_fields(iss_location, telemetry, astronauts, time_of_day)
+        return self._format_context_prompt(fields)
+    
+    def _context_fields(self, iss_location: Dict, telemetry: Dict, astronauts: Dict,
+                        time_of_day: Optional[str] = None) -> Dict[str, str]:
+        """The variable parts of the context prompt, formatted as they appear in it"""
         lat = iss_location.get('latitude', 0)
         lon = iss_location.get('longitude', 0)
-        altitude = telemetry.get('altitude_km', 408)
         velocity = telemetry.get('velocity_kmh', 27600)
-        temperature = telemetry.get('temperature_celsius', 0)
-        cosmic_rays = telemetry.get('cosmic_ray_intensity', 1.0)
-        crew_count = astronauts.get('count', 7)
-        
-        time_of_day = self._get_time_context()
         
+        # Values are coarsened so telemetry jitter doesn't produce distinct prompts
+        return {
+            'region': iss_location.get('region', 'Unknown region'),
+            'coordinates': f"{lat:.1f}°, {lon:.1f}°",
+            'altitude': f"{telemetry.get('altitude_km', 408):.0f}",
+            'velocity': f"{round(velocity, -1):,.0f}",
+            'temperature': f"{telemetry.get('temperature_celsius', 0):.0f}",
+            'cosmic_rays': f"{telemetry.get('cosmic_ray_intensity', 1.0):.1f}",
+            'crew_count': str(astronauts.get('count', 7)),
+            'time_of_day': time_of_day if time_of_day is not None else self._get_time_context()
+        }
+    
+    def _format_situation(self, fields: Dict[str, str]) -> str:
+        """The lines of the prompt that describe this moment"""
+        return f"""Location: Flying over {fields['region']} at coordinates {fields['coordinates']}
+Altitude: {fields['altitude']} km above Earth
+Velocity: {fields['velocity']} km/h
+External temperature: {fields['temperature']}°C
+Cosmic ray intensity: {fields['cosmic_rays']}
+Crew members aboard: {fields['crew_count']}
+Time context: {fields['time_of_day']}"""
+    
+    def _format_context_prompt(self, fields: Dict[str, str]) -> str:
         prompt = f"""Current situation aboard the ISS:
         
-Location: Flying over {region} at coordinates {lat:.2f}°, {lon:.2f}°
-Altitude: {altitude} km above Earth
-Velocity: {velocity:,} km/h
-External temperature: {temperature}°C
-Cosmic ray intensity: {cosmic_rays}
-Crew members aboard: {crew_count}
-Time context: {time_of_day}
+{self._format_situation(fields)}
 
 Write a personal diary entry reflecting on this moment in space, the view of Earth below, 
 the technical aspects of the mission, and the emotional experience of being in orbit."""
@@ -108,15 +478,7 @@ the technical aspects of the mission, and the emotional experience of being in o
     
     def _get_time_context(self) -> str:
         """Get contextual time information"""
-        hour = datetime.now().hour
-        if 5 <= hour < 12:
-            return "Morning watch - Earth awakening below"
-        elif 12 <= hour < 17:
-            return "Afternoon orbit - Sun illuminating continents"
-        elif 17 <= hour < 21:
-            return "Evening pass - City lights beginning to twinkle"
-        else:
-            return "Night shift - Darkness revealing Earth's glow"
+        return _HOUR_CONTEXT[datetime.now().hour]
     
     def _get_fallback_journal_entry(self, iss_location: Dict, telemetry: Dict) -> Dict[str, str]:
         """Fallback journal entry if API fails"""
@@ -1,18 +1,126 @@
 """
 Music generator module for creating space-inspired ambient music from telemetry data
 """
-import mido
 import numpy as np
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple
 import os
+import struct
 import tempfile
 from datetime import datetime
+from types import MappingProxyType
+
+# Earth regions mapped to musical scales/moods
+_REGION_SCALES = MappingProxyType({
+    'Pacific Ocean': 'peaceful',
+    'Atlantic Ocean': 'peaceful',
+    'Indian Ocean': 'ethereal',
+    'Arctic Ocean': 'mysterious',
+    'Antarctic': 'mysterious',
+    'North America': 'cosmic',
+    'South America': 'ethereal',
+    'Europe': 'cosmic',
+    'Africa': 'cosmic',
+    'Asia': 'ethereal',
+    'Australia': 'peaceful'
+})
+
+def _lerp(x: float, x0: float, x1: float, y0: float, y1: float) -> float:
+    """Scalar np.interp(x, [x0, x1], [y0, y1]) without the NumPy dispatch overhead"""
+    if x <= x0:
+        return float(y0)
+    if x >= x1:
+        return float(y1)
+    return (y1 - y0) / (x1 - x0) * (x - x0) + y0
+
+# Raw Standard MIDI File output. Mirrors what mido.MidiFile.save() wrote for
+# our single-track type-1 files, including running status, without building
+# a Python object per message.
+
+_VLQ_SMALL = tuple(bytes((delta,)) for delta in range(128))
+_END_OF_TRACK = b'\xff\x2f\x00'
+
+def _encode_vlq(value: int) -> bytes:
+    """Encode a delta time as a MIDI variable-length quantity"""
+    if value < 128:
+        return _VLQ_SMALL[value]
+    out = [value & 0x7f]
+    value >>= 7
+    while value:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    return bytes(reversed(out))
+
+def _write_smf(track_events: List[Tuple[int, bytes]], ticks_per_beat: int) -> bytes:
+    """Serialize (delta time, event bytes) pairs as a one-track type-1 MIDI file"""
+    body = bytearray()
+    running_status = None
+    for delta, event in track_events:
+        body += _encode_vlq(delta)
+        status = event[0]
+        if status == running_status:
+            body += event[1:]
+        else:
+            body += event
+        # Meta events (0xFF) cancel running status
+        running_status = status if status < 0xf0 else None
+    body += b'\x00' + _END_OF_TRACK
+    
+    header = b'MThd' + struct.pack('>LHHH', 6, 1, 1, ticks_per_beat)
+    return header + b'MTrk' + struct.pack('>L', len(body)) + bytes(body)
+
+# One row per note event of a composition; 'time' is the absolute tick
+_EVENT_DTYPE = np.dtype([
+    ('channel', 'u1'),
+    ('note', 'u1'),
+    ('vel', 'u1'),
+    ('on', bool),
+    ('time', 'i4'),
+])
+
+# Layer schedulers return parallel int32 arrays of (delta time, note, velocity)
+# for the layer's note_on/note_off events, in emission order. Velocity 0 marks
+# a note_off.
+
+def _schedule_pad(hold_time: int, chord_notes: np.ndarray, volume: int):
+    """All chord tones start together and are released together after hold_time"""
+    chord_size = len(chord_notes)
+    times = np.zeros(2 * chord_size, dtype=np.int32)
+    times[chord_size] = hold_time
+    notes = np.tile(chord_notes, 2).astype(np.int32)
+    velocities = np.repeat(np.array([volume, 0], dtype=np.int32), chord_size)
+    return times, notes, velocities
+
+def _schedule_melody(total_ticks: int, note_count: int, scale_notes: np.ndarray,
+                     volume: int, rng: np.random.Generator):
+    """Evenly spaced notes drawn from the scale, each held for half the gap"""
+    # Note duration (shorter for higher density) and time to next note
+    note_duration = int(total_ticks / (note_count * 2)) if note_count else 0
+    time_to_note = int(total_ticks / note_count) if note_count else 0
+    
+    notes = scale_notes[rng.integers(0, len(scale_notes), size=note_count)]
+    
+    times = np.tile(np.array([time_to_note, note_duration], dtype=np.int32), note_count)
+    velocities = np.tile(np.array([volume, 0], dtype=np.int32), note_count)
+    return times, np.repeat(notes, 2).astype(np.int32), velocities
+
+def _schedule_texture(total_ticks: int, texture_count: int, duration: int,
+                      high_notes: np.ndarray, volume: int, rng: np.random.Generator):
+    """Short sparkles back to back; only the first one is offset in time"""
+    notes = high_notes[rng.integers(0, len(high_notes), size=texture_count)]
+    time_offset = int(rng.integers(0, total_ticks))
+    
+    times = np.tile(np.array([0, duration], dtype=np.int32), texture_count)
+    if texture_count:
+        times[0] = time_offset
+    velocities = np.tile(np.array([volume, 0], dtype=np.int32), texture_count)
+    return times, np.repeat(notes, 2).astype(np.int32), velocities
 
 class SpaceMusicGenerator:
     def __init__(self):
         self.tempo = 60  # BPM for ambient space music
         self.duration = 30  # seconds
         self.ticks_per_beat = 480
+        self._rng = np.random.default_rng()
         
         # Musical scales for different moods
         self.scales = {
@@ -21,9 +129,22 @@ class SpaceMusicGenerator:
             'cosmic': [60, 64, 67, 71, 74, 77, 81, 84],  # C major 7th extensions
             'ethereal': [60, 65, 67, 72, 74, 79, 81, 86]  # Perfect 4ths and 5ths
         }
+        
+        # Scales transposed to each reachable base octave (3-5), built once
+        self._scale_table = {
+            name: {
+                octave: np.array([note + (octave - 4) * 12 for note in notes], dtype=np.int16)
+                for octave in range(3, 6)
+            }
+            for name, notes in self.scales.items()
+        }
     
-    def generate_space_music(self, space_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Generate ambient space music from telemetry data"""
+    def generate_space_music(self, space_data: Dict[str, Any], to_disk: bool = False) -> Dict[str, Any]:
+        """Generate ambient space music from telemetry data
+        
+        The MIDI data is returned in memory as 'midi_bytes'; pass to_disk=True to
+        also write it to the temp directory ('filepath' is None otherwise).
+        """
         
         telemetry = space_data.get('telemetry', {})
         iss_location = space_data.get('iss_location', {})
@@ -32,16 +153,19 @@ class SpaceMusicGenerator:
         musical_params = self._map_data_to_music(telemetry, iss_location)
         
         # Generate MIDI
-        midi_file = self._create_midi_composition(musical_params)
+        midi_bytes = self._create_midi_composition(musical_params)
         
-        # Save to temporary file
-        temp_dir = tempfile.gettempdir()
         filename = f"space_music_{datetime.now().strftime('%Y%m%d_%H%M%S')}.mid"
-        filepath = os.path.join(temp_dir, filename)
+        filepath = None
         
-        midi_file.save(filepath)
+        if to_disk:
+            # Save to temporary file
+            filepath = os.path.join(tempfile.gettempdir(), filename)
+            with open(filepath, 'wb') as f:
+                f.write(midi_bytes)
         
         return {
+            'midi_bytes': midi_bytes,
             'filepath': filepath,
             'filename': filename,
             'musical_params': musical_params,
@@ -64,19 +188,19 @@ class SpaceMusicGenerator:
         scale_type = self._get_scale_for_region(region)
         
         # Map altitude to octave (higher = higher pitch)
-        base_octave = int(np.interp(altitude, [400, 430], [3, 5]))
+        base_octave = int(_lerp(altitude, 400, 430, 3, 5))
         
         # Map velocity to rhythm density
-        note_density = np.interp(velocity, [27400, 27800], [0.3, 0.8])
+        note_density = _lerp(velocity, 27400, 27800, 0.3, 0.8)
         
         # Map temperature to dynamics (volume)
-        volume = int(np.interp(temperature, [-160, 130], [40, 100]))
+        volume = int(_lerp(temperature, -160, 130, 40, 100))
         
         # Map cosmic rays to harmonic complexity
-        harmony_complexity = np.interp(cosmic_rays, [0.1, 2.5], [0.2, 0.9])
+        harmony_complexity = _lerp(cosmic_rays, 0.1, 2.5, 0.2, 0.9)
         
         # Map solar efficiency to brightness (major vs minor tendencies)
-        brightness = np.interp(solar_efficiency, [80, 100], [0.3, 1.0])
+        brightness = _lerp(solar_efficiency, 80, 100, 0.3, 1.0)
         
         return {
             'scale_type': scale_type,
@@ -91,72 +215,78 @@ class SpaceMusicGenerator:
     
     def _get_scale_for_region(self, region: str) -> str:
         """Map Earth regions to musical scales/moods"""
-        region_scales = {
-            'Pacific Ocean': 'peaceful',
-            'Atlantic Ocean': 'peaceful',
-            'Indian Ocean': 'ethereal',
-            'Arctic Ocean': 'mysterious',
-            'Antarctic': 'mysterious',
-            'North America': 'cosmic',
-            'South America': 'ethereal',
-            'Europe': 'cosmic',
-            'Africa': 'cosmic',
-            'Asia': 'ethereal',
-            'Australia': 'peaceful'
-        }
-        return region_scales.get(region, 'peaceful')
+        return _REGION_SCALES.get(region, 'peaceful')
     
-    def _create_midi_composition(self, params: Dict[str, Any]) -> mido.MidiFile:
-        """Create MIDI composition from musical parameters"""
+    def _create_midi_composition(self, params: Dict[str, Any]) -> bytes:
+        """Create MIDI composition from musical parameters, as Standard MIDI File bytes"""
         
-        mid = mido.MidiFile(ticks_per_beat=self.ticks_per_beat)
-        track = mido.MidiTrack()
-        mid.tracks.append(track)
+        events = self._plan_composition(params)
+        
+        track: List[Tuple[int, bytes]] = []
         
         # Set tempo
         tempo_microseconds = int(60000000 / params['tempo'])
-        track.append(mido.MetaMessage('set_tempo', tempo=tempo_microseconds))
+        track.append((0, b'\xff\x51\x03' + tempo_microseconds.to_bytes(3, 'big')))
+        
+        # Single pass over the whole piece, converting absolute ticks to deltas
+        deltas = np.diff(events['time'], prepend=0)
+        status = np.where(events['on'], 0x90, 0x80) | events['channel']
+        track.extend(
+            (delta, bytes((status_byte, note, velocity)))
+            for delta, status_byte, note, velocity in zip(
+                deltas.tolist(), status.tolist(), events['note'].tolist(), events['vel'].tolist()
+            )
+        )
+        
+        return _write_smf(track, self.ticks_per_beat)
+    
+    def _plan_composition(self, params: Dict[str, Any]) -> np.ndarray:
+        """Schedule every note event of the piece as one _EVENT_DTYPE array sorted by absolute tick"""
         
         # Get scale notes
-        scale_notes = self.scales[params['scale_type']]
-        base_octave_offset = (params['base_octave'] - 4) * 12
-        scale_notes = [note + base_octave_offset for note in scale_notes]
-        
-        # Generate ambient pad layer
-        self._add_ambient_pad(track, scale_notes, params)
+        scale_notes = self._scale_table[params['scale_type']][params['base_octave']]
         
-        # Generate melodic layer
-        self._add_melodic_layer(track, scale_notes, params)
-        
-        # Add some cosmic texture
+        # Ambient pad, then melody, then (for complex harmony) cosmic texture
+        layers = [
+            (0, self._ambient_pad_layer(scale_notes, params)),
+            (1, self._melodic_layer(scale_notes, params)),
+        ]
         if params['harmony_complexity'] > 0.5:
-            self._add_cosmic_texture(track, scale_notes, params)
-        
-        return mid
+            layers.append((2, self._cosmic_texture_layer(scale_notes, params)))
+        
+        events = np.empty(sum(len(times) for _, (times, _, _) in layers), dtype=_EVENT_DTYPE)
+        
+        # Each layer's delta times continue from where the previous layer ended
+        start = 0
+        offset = 0
+        for channel, (times, notes, velocities) in layers:
+            layer = events[start:start + len(times)]
+            layer['channel'] = channel
+            layer['note'] = notes
+            layer['vel'] = velocities
+            layer['on'] = velocities > 0
+            layer['time'] = offset + np.cumsum(times)
+            if len(times):
+                offset = int(layer['time'][-1])
+            start += len(times)
+        
+        return events[np.argsort(events['time'], kind='stable')]
     
-    def _add_ambient_pad(self, track: mido.MidiTrack, scale_notes: List[int], params: Dict):
-        """Add sustained ambient pad sounds"""
+    def _ambient_pad_layer(self, scale_notes: np.ndarray, params: Dict):
+        """Sustained ambient pad sounds"""
         
-        # Select chord tones
-        chord_notes = [scale_notes[0], scale_notes[2], scale_notes[4]]  # Root, 3rd, 5th
-        if params['brightness'] > 0.7:
-            chord_notes.append(scale_notes[6])  # Add 7th for brightness
+        # Select chord tones: root, 3rd, 5th, plus the 7th for brightness
+        chord_notes = scale_notes[[0, 2, 4, 6] if params['brightness'] > 0.7 else [0, 2, 4]]
         
         volume = max(30, int(params['volume'] * 0.6))  # Softer for pad
         
-        # Long sustained notes
-        for note in chord_notes:
-            track.append(mido.Message('note_on', channel=0, note=note, velocity=volume, time=0))
-        
         # Hold for most of the duration
         hold_time = int(self.duration * 0.8 * self.ticks_per_beat * params['tempo'] / 60)
         
-        for i, note in enumerate(chord_notes):
-            time = hold_time if i == 0 else 0
-            track.append(mido.Message('note_off', channel=0, note=note, velocity=0, time=time))
+        return _schedule_pad(hold_time, chord_notes, volume)
     
-    def _add_melodic_layer(self, track: mido.MidiTrack, scale_notes: List[int], params: Dict):
-        """Add sparse melodic elements"""
+    def _melodic_layer(self, scale_notes: np.ndarray, params: Dict):
+        """Sparse melodic elements"""
         
         volume = int(params['volume'] * 0.8)
         note_count = int(params['note_density'] * 12)  # Max 12 notes in 30 seconds
@@ -164,43 +294,21 @@ class SpaceMusicGenerator:
         # Calculate timing between notes
         total_ticks = int(self.duration * self.ticks_per_beat * params['tempo'] / 60)
         
-        current_time = 0
-        for i in range(note_count):
-            # Select note from scale
-            note_index = int(np.random.random() * len(scale_notes))
-            note = scale_notes[note_index]
-            
-            # Note duration (shorter for higher density)
-            note_duration = int(total_ticks / (note_count * 2))
-            
-            # Time to next note
-            time_to_note = int(total_ticks / note_count) if i == 0 else int(total_ticks / note_count)
-            
-            track.append(mido.Message('note_on', channel=1, note=note, velocity=volume, time=time_to_note))
-            track.append(mido.Message('note_off', channel=1, note=note, velocity=0, time=note_duration))
+        return _schedule_melody(total_ticks, note_count, scale_notes, volume, self._rng)
     
-    def _add_cosmic_texture(self, track: mido.MidiTrack, scale_notes: List[int], params: Dict):
-        """Add subtle cosmic texture sounds"""
+    def _cosmic_texture_layer(self, scale_notes: np.ndarray, params: Dict):
+        """Subtle cosmic texture sounds"""
         
         volume = int(params['volume'] * 0.4)  # Very subtle
         
         # High register sparkles
-        high_notes = [note + 24 for note in scale_notes[:4]]  # Two octaves up
+        high_notes = scale_notes[:4] + 24  # Two octaves up
         
         texture_count = int(params['harmony_complexity'] * 8)
         total_ticks = int(self.duration * self.ticks_per_beat * params['tempo'] / 60)
+        duration = int(self.ticks_per_beat / 4)  # Short notes
         
-        for i in range(texture_count):
-            note = high_notes[int(np.random.random() * len(high_notes))]
-            time_offset = int(np.random.random() * total_ticks)
-            duration = int(self.ticks_per_beat / 4)  # Short notes
-            
-            if i == 0:
-                track.append(mido.Message('note_on', channel=2, note=note, velocity=volume, time=time_offset))
-            else:
-                track.append(mido.Message('note_on', channel=2, note=note, velocity=volume, time=0))
-            
-            track.append(mido.Message('note_off', channel=2, note=note, velocity=0, time=duration))
+        return _schedule_texture(total_ticks, texture_count, duration, high_notes, volume, self._rng)
     
     def _generate_music_description(self, params: Dict, iss_location: Dict) -> str:
         """Generate a poetic description of the generated music"""
@@ -243,7 +351,7 @@ if __name__ == "__main__":
     }
     
     generator = SpaceMusicGenerator()
-    result = generator.generate_space_music(mock_data)
+    result = generator.generate_space_music(mock_data, to_disk=True)
     print(f"Generated: {result['filename']}")
     print(f"Description: {result['description']}")
     print(f"Musical parameters: {result['musical_params']}")
@@ -21,6 +21,16 @@ class VoicesOfSpace:
         self.output_dir = "generated_entries"
         os.makedirs(self.output_dir, exist_ok=True)
     
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def close(self):
+        """Release the data fetcher's HTTP client and event loop"""
+        self.data_fetcher.close()
+    
     def create_daily_entry(self) -> Dict[str, Any]:
         """Create a complete daily space journal entry with music"""
         
@@ -31,7 +41,7 @@ class VoicesOfSpace:
         journal_entry = self.journal_generator.generate_journal_entry(space_data)
         
         print("🎵 Creating space music...")
-        music_data = self.music_generator.generate_space_music(space_data)
+        music_data = self.music_generator.generate_space_music(space_data, to_disk=True)
         
         # Combine everything into a complete entry
         complete_entry = {